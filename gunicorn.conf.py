@@ -0,0 +1,19 @@
+import multiprocessing
+
+# Production server configuration: multiple Uvicorn workers so CPU-bound
+# stages (ADIME parsing, WeasyPrint PDF rendering) don't serialize every
+# request through a single event loop.
+#
+# Run with: gunicorn main:app
+#
+# Note: the /image-status endpoint tracks jobs in process memory, so polls
+# are only guaranteed to see a job with workers = 1. With more workers,
+# image generation still runs and its files land on disk, but status polls
+# routed to another worker report "unknown".
+bind = "0.0.0.0:8000"
+worker_class = "uvicorn.workers.UvicornWorker"
+workers = multiprocessing.cpu_count()
+
+# Import the app (and its Jinja/template caches) once in the master and
+# fork, instead of rebuilding them in every worker
+preload_app = True
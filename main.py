@@ -1,21 +1,34 @@
+import asyncio
+import logging
 import os
+import time
+import uuid
 from fastapi import FastAPI, File, UploadFile, Form, Request
 from fastapi.responses import HTMLResponse, FileResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
+from jinja2 import FileSystemBytecodeCache
 import uvicorn
 from pathlib import Path
 from dotenv import load_dotenv
 from datetime import datetime
 
 # Import services
+from services import image_gen, parse_adime
 from services.parse_adime import parse_adime_text
-from services.image_gen import generate_images
+from services.image_gen import generate_images, ensure_placeholder_images_exist
 from services.pdf_gen import generate_pdf
 
 # Load environment variables
 load_dotenv()
 
+# Logging
+# Diagnostic output goes through a logger gated on level instead of print(),
+# so the hot paths don't pay for string formatting or stdout flushes unless
+# DEBUG is actually enabled. Set LOG_LEVEL=DEBUG in .env to get the old output.
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO").upper())
+logger = logging.getLogger("heidi")
+
 # Development Mode
 # The app checks for DEV_MODE in the environment variables (default: True)
 # When DEV_MODE is True, the image generator uses placeholders or existing images
@@ -38,78 +51,162 @@ app = FastAPI(title="ADIME Note Processor")
 # Mount static files
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
+# In-process image generation jobs, keyed by job id. Image generation can take
+# 10-30s per image against the OpenAI API, so /upload-adime/ schedules it as a
+# background task and returns the preview immediately; the frontend can poll
+# /image-status/{job_id} for the finished images.
+#
+# NOTE: the store is per-process, so with multiple gunicorn workers a poll can
+# land on a worker that never saw the job and get "unknown". Keep workers = 1
+# (see gunicorn.conf.py) if /image-status must be reliable, or move the store
+# to something shared. Entries are evicted after _IMAGE_JOB_TTL seconds so
+# jobs that are never polled don't accumulate. Values are (task, created_at).
+image_jobs = {}
+_IMAGE_JOB_TTL = 30 * 60
+
+def _evict_stale_image_jobs():
+    """Drop finished jobs whose results were never collected."""
+    cutoff = time.monotonic() - _IMAGE_JOB_TTL
+    stale = [jid for jid, (task, created) in image_jobs.items()
+             if task.done() and created < cutoff]
+    for jid in stale:
+        image_jobs.pop(jid, None)
+
 # Set up templates
+# Cache compiled templates so rendering doesn't re-read and re-compile them on
+# every request: disable auto_reload outside DEV_MODE, keep compiled bytecode
+# on disk across restarts, and pre-warm the two templates we actually serve
+Path(".jinja_cache").mkdir(exist_ok=True)
 templates = Jinja2Templates(directory="templates")
+templates.env.auto_reload = DEV_MODE
+templates.env.cache_size = 400
+templates.env.bytecode_cache = FileSystemBytecodeCache(directory=".jinja_cache")
+
+# Bind the two templates we serve once outside DEV_MODE, so handlers skip
+# the per-request name lookup that TemplateResponse does through
+# env.get_template. In DEV_MODE we must go through get_template each time:
+# holding the Template object would bypass the auto_reload up-to-date check
+# and template edits would never show up.
+FORM_TMPL = None if DEV_MODE else templates.env.get_template("form.html")
+REPORT_TMPL = None if DEV_MODE else templates.env.get_template("report_template.html")
+
+@app.on_event("startup")
+async def warm_placeholder_images():
+    """Create placeholder images once at startup, off the event loop.
+
+    This used to run at import time of services.image_gen, which slowed cold
+    starts (disk scan, PIL import, PNG write) before any request was served.
+    """
+    await asyncio.to_thread(ensure_placeholder_images_exist)
+
+@app.on_event("shutdown")
+async def shutdown_http_clients():
+    """Close the pooled HTTP clients held by the services."""
+    await image_gen.close_client()
+    await parse_adime.close_client()
 
 @app.get("/", response_class=HTMLResponse)
 async def upload_form(request: Request):
     """Render the upload form."""
-    return templates.TemplateResponse("form.html", {"request": request})
+    tmpl = FORM_TMPL or templates.env.get_template("form.html")
+    return HTMLResponse(tmpl.render(request=request))
 
 @app.post("/upload-adime/")
 async def upload_adime(request: Request, 
                      file: UploadFile = File(None),
                      text_content: str = Form(None)):
     """Process uploaded ADIME content and create editable preview."""
-    print("\nDEBUG: Processing upload-adime request")
+    logger.debug("Processing upload-adime request")
     
     # Use either uploaded file or text input
     content = ""
     if file:
-        content = await file.read()
-        content = content.decode("utf-8")
-        print(f"DEBUG: Received content from file upload, length: {len(content)}")
+        # Read the upload in 64 KiB chunks instead of buffering it in one
+        # shot, so a large file doesn't spike memory or hog the event loop
+        buf = bytearray()
+        while chunk := await file.read(65536):
+            buf.extend(chunk)
+        content = buf.decode("utf-8")
+        logger.debug("Received content from file upload, length: %s", len(content))
     elif text_content:
         content = text_content
-        print(f"DEBUG: Received content from text input, length: {len(content)}")
+        logger.debug("Received content from text input, length: %s", len(content))
     else:
-        print("DEBUG: No ADIME content provided")
+        logger.debug("No ADIME content provided")
         return {"error": "No ADIME content provided"}
     
     # Parse ADIME text to structured data
-    print("DEBUG: Calling parse_adime_text")
+    logger.debug("Calling parse_adime_text")
     adime_data = await parse_adime_text(content)
-    print(f"DEBUG: Received parsed ADIME data with keys: {adime_data.keys()}")
-    
-    # Generate images for action items
-    print("DEBUG: Calling generate_images")
-    image_paths = await generate_images(adime_data)
-    print(f"DEBUG: Received {len(image_paths)} image paths from generate_images")
+    logger.debug("Received parsed ADIME data with keys: %s", adime_data.keys())
     
+    # Schedule image generation in the background instead of holding the
+    # request open for the duration of the OpenAI image calls
+    logger.debug("Scheduling generate_images in the background")
+    _evict_stale_image_jobs()
+    job_id = uuid.uuid4().hex
+    image_jobs[job_id] = (asyncio.create_task(generate_images(adime_data)), time.monotonic())
+
     # Combine data and render preview template
     context = {
         "request": request,
         "adime_data": adime_data,
-        "image_paths": image_paths,
+        "image_paths": [],
+        "image_job_id": job_id,
         "now": datetime.now()
     }
     
-    print("DEBUG: Rendering report_template.html")
-    return templates.TemplateResponse("report_template.html", context)
+    logger.debug("Rendering report_template.html")
+    tmpl = REPORT_TMPL or templates.env.get_template("report_template.html")
+    return HTMLResponse(tmpl.render(**context))
+
+@app.get("/image-status/{job_id}")
+async def image_status(job_id: str):
+    """Report the status of a background image generation job."""
+    entry = image_jobs.get(job_id)
+    if entry is None:
+        return {"status": "unknown"}
+    task, _ = entry
+    if not task.done():
+        return {"status": "pending"}
+
+    # Job finished - hand back the results and drop the entry
+    image_jobs.pop(job_id, None)
+    try:
+        return {"status": "done", "images": task.result()}
+    except Exception as e:
+        logger.warning("Image job %s failed: %s", job_id, e)
+        return {"status": "error"}
 
 @app.post("/generate-pdf/")
 async def create_pdf(request: Request, html_content: str = Form(...)):
     """Generate PDF from edited HTML content."""
-    print("\nDEBUG: Processing generate-pdf request")
-    print(f"DEBUG: Received HTML content length: {len(html_content)}")
+    logger.debug("Processing generate-pdf request")
+    logger.debug("Received HTML content length: %s", len(html_content))
     
     # Save PDF to static directory
-    print("DEBUG: Calling generate_pdf")
+    logger.debug("Calling generate_pdf")
     pdf_path = await generate_pdf(html_content)
     
     if not pdf_path:
-        print("DEBUG: No PDF path returned from generate_pdf")
+        logger.debug("No PDF path returned from generate_pdf")
         return {"error": "Failed to generate PDF"}
     
-    # Return PDF file for download
-    filename = pdf_path.split("/")[-1]
-    print(f"DEBUG: Returning PDF file: {filename}, path: {pdf_path}")
-    
+    # Return PDF file for download. Stat the file once (off the event loop)
+    # and hand the result to FileResponse so it doesn't stat again per send.
+    filename = os.path.basename(pdf_path)
+    logger.debug("Returning PDF file: %s, path: %s", filename, pdf_path)
+
+    stat_result = await asyncio.to_thread(os.stat, pdf_path)
     return FileResponse(
         path=pdf_path,
         filename=filename,
-        media_type="application/pdf"
+        media_type="application/pdf",
+        stat_result=stat_result
     )
 
 if __name__ == "__main__":
-    uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True) 
\ No newline at end of file
+    # uvloop replaces the stdlib selector loop with a libuv-based one, cutting
+    # per-request scheduling overhead while we await OpenAI calls and file I/O
+    uvicorn.run("main:app", host="0.0.0.0", port=8000,
+                loop="uvloop", http="httptools", reload=True)
\ No newline at end of file
@@ -1,21 +1,76 @@
 import os
-import uuid
-import base64
+import hashlib
+import logging
 import random
 import glob
+from binascii import a2b_base64
 from typing import Dict, Any, List, Optional
 import httpx
 import asyncio
+import aiofiles
 from dotenv import load_dotenv
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 # Get OpenAI API key from environment variables
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 # Check if DEV_MODE is enabled (default to True if not specified)
 DEV_MODE = os.getenv("DEV_MODE", "True").lower() in ("true", "1", "t", "yes")
 IMAGE_DIR = "static/generated_images"
 
+# Shared HTTP client so every image request reuses pooled keep-alive
+# connections to api.openai.com instead of paying DNS + TCP + TLS per call
+_CLIENT = httpx.AsyncClient(
+    http2=True,
+    timeout=60.0,
+    limits=httpx.Limits(max_keepalive_connections=20, max_connections=50),
+)
+
+async def close_client():
+    """Close the shared HTTP client (called on app shutdown)."""
+    await _CLIENT.aclose()
+
+# Cap concurrent OpenAI image calls instead of truncating the action item list.
+# Every item gets an image; the semaphore provides the backpressure that the
+# old [:3] slice only approximated.
+_SEM = asyncio.Semaphore(int(os.getenv("IMAGE_CONCURRENCY", "3")))
+
+# Per-prompt locks so concurrent duplicate prompts in one request don't all
+# hit the API; the first coroutine generates, the rest find the cached file.
+# Bounded: once the table is full, idle locks are dropped before adding a
+# new one (a dropped lock only costs a duplicate API call on the next race).
+_PROMPT_LOCKS = {}
+_PROMPT_LOCKS_MAX = 256
+
+def _prompt_lock(key: str) -> asyncio.Lock:
+    """Lock for a prompt hash, evicting idle locks when the table is full."""
+    lock = _PROMPT_LOCKS.get(key)
+    if lock is None:
+        if len(_PROMPT_LOCKS) >= _PROMPT_LOCKS_MAX:
+            for stale_key in [k for k, l in _PROMPT_LOCKS.items() if not l.locked()]:
+                del _PROMPT_LOCKS[stale_key]
+        lock = _PROMPT_LOCKS.setdefault(key, asyncio.Lock())
+    return lock
+
+# Boilerplate prepended to every image prompt, built once instead of
+# re-interpolating a ~400 character f-string per generated image
+_ENHANCED_PROMPT_PREFIX = """
+        Create a professional, clear infographic illustration for the specific nutrition recommendation below.
+        The image should:
+        - Show actual examples of the recommended foods/meals based solely on the recommendation context
+        - Use a soft color palette suitable for healthcare
+        - Be visually specific to the exact recommendation, not generic
+        - Include realistic food portions and combinations relevant to the health context
+        - Have a clean, minimalist design focused on the recommended foods
+        - No text overlay necessary (text will be added separately)
+        - Designed from the patient's perspective (what "I" should eat/do)
+        - Be specific to the patient's health context
+
+        The specific nutritional recommendation is:
+        """
+
 # Create image directory if it doesn't exist
 os.makedirs(IMAGE_DIR, exist_ok=True)
 
@@ -24,7 +79,7 @@ def ensure_placeholder_images_exist():
     """Create placeholder images if they don't exist already."""
     placeholder_path = os.path.join(IMAGE_DIR, "placeholder.png")
     if not os.path.exists(placeholder_path):
-        print(f"DEBUG: Creating placeholder image at {placeholder_path}")
+        logger.debug("Creating placeholder image at %s", placeholder_path)
         try:
             # Create a simple placeholder image using any available library
             # For this example, we'll just copy an existing image if available
@@ -33,7 +88,7 @@ def ensure_placeholder_images_exist():
                 # Use an existing image as placeholder
                 import shutil
                 shutil.copy(existing_images[0], placeholder_path)
-                print(f"DEBUG: Copied existing image as placeholder")
+                logger.debug("Copied existing image as placeholder")
             else:
                 # Create a basic colored rectangle if no images available
                 try:
@@ -42,17 +97,41 @@ def ensure_placeholder_images_exist():
                     d = ImageDraw.Draw(img)
                     d.rectangle([(200, 150), (600, 450)], fill=(128, 200, 255))
                     img.save(placeholder_path)
-                    print(f"DEBUG: Created new placeholder image with PIL")
+                    logger.debug("Created new placeholder image with PIL")
                 except ImportError:
                     # If PIL is not available, just create an empty file
                     with open(placeholder_path, 'wb') as f:
                         f.write(b'')
-                    print(f"DEBUG: Created empty placeholder file (PIL not available)")
+                    logger.debug("Created empty placeholder file (PIL not available)")
         except Exception as e:
-            print(f"DEBUG: Error creating placeholder: {str(e)}")
+            logger.warning("Error creating placeholder: %s", str(e))
 
-# Ensure placeholders exist on module load
-ensure_placeholder_images_exist()
+# Cached listing of reusable dev-mode images, invalidated by directory mtime
+# so we don't re-walk IMAGE_DIR on every request
+_DEV_IMAGES: List[str] = []
+_DEV_IMAGES_MTIME = -1
+
+def _synthetic_image_info(action_item: Dict[str, Any]) -> Dict[str, str]:
+    """Build a placeholder result for an action item without calling the API."""
+    return {
+        "title": action_item["title"],
+        "description": action_item["description"],
+        "image_path": "/static/generated_images/placeholder.png"
+    }
+
+def _get_dev_images() -> List[str]:
+    """Return reusable dev-mode images, rescanning only when IMAGE_DIR changes."""
+    global _DEV_IMAGES, _DEV_IMAGES_MTIME
+    mtime = os.stat(IMAGE_DIR).st_mtime_ns
+    if mtime != _DEV_IMAGES_MTIME:
+        with os.scandir(IMAGE_DIR) as entries:
+            _DEV_IMAGES = [
+                entry.path for entry in entries
+                if entry.name.endswith(".png") and "placeholder" not in entry.name
+            ]
+        _DEV_IMAGES_MTIME = mtime
+        logger.debug("Rescanned %s, %s reusable images", IMAGE_DIR, len(_DEV_IMAGES))
+    return _DEV_IMAGES
 
 async def generate_images(adime_data: Dict[str, Any]) -> List[Dict[str, str]]:
     """
@@ -64,8 +143,8 @@ async def generate_images(adime_data: Dict[str, Any]) -> List[Dict[str, str]]:
     Returns:
         List of dictionaries with action item and corresponding image path
     """
-    print(f"DEBUG: Received ADIME data structure: {type(adime_data)}")
-    print(f"DEBUG: ADIME data keys: {adime_data.keys()}")
+    logger.debug("Received ADIME data structure: %s", type(adime_data))
+    logger.debug("ADIME data keys: %s", adime_data.keys())
     
     # Get action items from intervention section
     action_items = []
@@ -73,51 +152,70 @@ async def generate_images(adime_data: Dict[str, Any]) -> List[Dict[str, str]]:
     # Check if we have the new structure with nested intervention
     if isinstance(adime_data.get("intervention"), dict) and "action_items" in adime_data["intervention"]:
         action_items = adime_data["intervention"]["action_items"]
-        print(f"DEBUG: Found action_items inside intervention dict")
+        logger.debug("Found action_items inside intervention dict")
     # Check if we have flat action_items list
     elif "action_items" in adime_data:
         action_items = adime_data["action_items"]
-        print(f"DEBUG: Found action_items at top level")
+        logger.debug("Found action_items at top level")
     
-    print(f"DEBUG: Number of action items found: {len(action_items)}")
+    logger.debug("Number of action items found: %s", len(action_items))
     
     # If no action items found, return empty list
     if not action_items:
-        print("DEBUG: No action items found to generate images for")
+        logger.debug("No action items found to generate images for")
         return []
     
     # Check if we're in DEV MODE - if so, use existing images or placeholders
     if DEV_MODE:
-        print("DEBUG: Running in DEV_MODE - using existing images or placeholders instead of calling API")
+        logger.debug("Running in DEV_MODE - using existing images or placeholders instead of calling API")
         return await generate_dev_images_for_action_items(action_items)
-    
-    # Generate images for each action item (up to 3 to avoid rate limiting)
-    image_tasks = []
-    for i, item in enumerate(action_items[:3]):  # Limit to 3 images
-        print(f"DEBUG: Processing action item {i}: {item.get('title', 'No title')}")
+
+    # Without an API key there is nothing to schedule: return synthetic
+    # results directly rather than spinning up coroutines that would each
+    # discover the missing key and bail out individually
+    if not OPENAI_API_KEY:
+        logger.debug("No OpenAI API key provided. Cannot generate images.")
+        return [_synthetic_image_info(item) for item in action_items]
+
+    # Group action items by prompt so duplicates share one API round-trip
+    # (the images endpoint accepts n > 1 for a single prompt); distinct
+    # prompts still go out as individual requests. Concurrency is bounded
+    # by _SEM either way.
+    prompt_groups = {}
+    for i, item in enumerate(action_items):
+        logger.debug("Processing action item %s: %s", i, item.get('title', 'No title'))
         if "visualization_prompt" in item:
             prompt = item["visualization_prompt"]
-            print(f"DEBUG: Using visualization_prompt")
+            logger.debug("Using visualization_prompt")
         else:
             prompt = f"Create a simple, clear infographic for a personal nutritional goal with first-person perspective (I should, I will): {item['description'][:100]}"
-            print(f"DEBUG: Generated default prompt")
-        
-        task = generate_image_for_action(item, prompt)
-        image_tasks.append(task)
-    
+            logger.debug("Generated default prompt")
+        prompt_groups.setdefault(prompt, []).append(item)
+
+    image_tasks = []
+    for prompt, items in prompt_groups.items():
+        if len(items) == 1:
+            image_tasks.append(_bounded_generate_image(items[0], prompt))
+        else:
+            logger.debug("Batching %s action items with identical prompt into one request", len(items))
+            image_tasks.append(_bounded_generate_image_batch(items, prompt))
+
     # Wait for all image generation tasks to complete
     results = await asyncio.gather(*image_tasks, return_exceptions=True)
-    
+
     # Filter out any exceptions and collect successful results
     image_info = []
     for i, result in enumerate(results):
         if isinstance(result, Exception):
-            print(f"DEBUG: Error generating image {i}: {str(result)}")
+            logger.warning("Error generating image %s: %s", i, str(result))
         elif isinstance(result, dict) and "image_path" in result:
-            print(f"DEBUG: Successfully generated image {i}: {result['image_path']}")
+            logger.debug("Successfully generated image %s: %s", i, result['image_path'])
             image_info.append(result)
-    
-    print(f"DEBUG: Returning {len(image_info)} image info items")
+        elif isinstance(result, list):
+            logger.debug("Batch %s produced %s images", i, len(result))
+            image_info.extend(result)
+
+    logger.debug("Returning %s image info items", len(image_info))
     return image_info
 
 async def generate_dev_images_for_action_items(action_items: List[Dict[str, Any]]) -> List[Dict[str, str]]:
@@ -133,14 +231,14 @@ async def generate_dev_images_for_action_items(action_items: List[Dict[str, Any]
     """
     image_info = []
     
-    # Get list of existing images
-    existing_images = glob.glob(os.path.join(IMAGE_DIR, "*.png"))
-    existing_images = [img for img in existing_images if "placeholder" not in img]
-    print(f"DEBUG: Found {len(existing_images)} existing images to reuse")
+    # Get list of existing images (cached; rescanned only on directory change)
+    existing_images = _get_dev_images()
+    logger.debug("Found %s existing images to reuse", len(existing_images))
     
     # If no existing images (other than placeholder), ensure placeholder exists
+    # (in a worker thread - this can touch disk and import PIL)
     if not existing_images:
-        ensure_placeholder_images_exist()
+        await asyncio.to_thread(ensure_placeholder_images_exist)
         placeholder_path = os.path.join(IMAGE_DIR, "placeholder.png")
         if os.path.exists(placeholder_path):
             existing_images = [placeholder_path]
@@ -153,11 +251,11 @@ async def generate_dev_images_for_action_items(action_items: List[Dict[str, Any]
             img_path = random.choice(existing_images)
             filename = os.path.basename(img_path)
             image_path = f"/static/generated_images/{filename}"
-            print(f"DEBUG: Reusing existing image for action item {i}: {image_path}")
+            logger.debug("Reusing existing image for action item %s: %s", i, image_path)
         else:
             # Use placeholder as fallback
             image_path = "/static/generated_images/placeholder.png"
-            print(f"DEBUG: Using placeholder image for action item {i}")
+            logger.debug("Using placeholder image for action item %s", i)
         
         # Add to result
         image_info.append({
@@ -168,6 +266,115 @@ async def generate_dev_images_for_action_items(action_items: List[Dict[str, Any]
     
     return image_info
 
+async def _bounded_generate_image(action_item: Dict[str, str], prompt: str) -> Dict[str, str]:
+    """Run generate_image_for_action under the concurrency semaphore."""
+    async with _SEM:
+        return await generate_image_for_action(action_item, prompt)
+
+async def _bounded_generate_image_batch(action_items: List[Dict[str, Any]], prompt: str) -> List[Dict[str, str]]:
+    """Run generate_images_for_prompt under the concurrency semaphore."""
+    async with _SEM:
+        return await generate_images_for_prompt(action_items, prompt)
+
+async def generate_images_for_prompt(action_items: List[Dict[str, Any]], prompt: str) -> List[Dict[str, str]]:
+    """
+    Generate one image per action item in a single API request.
+
+    Used when several action items share the same prompt: one POST with
+    n=len(action_items) replaces a round-trip per item, and each returned
+    image is zipped back to its action item. The prompt gets the same
+    infographic prefix and hash-derived filenames as the single-item path,
+    so batched results land in - and are served from - the same cache.
+
+    Args:
+        action_items: Action items that share the prompt
+        prompt: Prompt to generate the images
+
+    Returns:
+        List of dictionaries with action item info and image path
+    """
+    placeholder = [_synthetic_image_info(item) for item in action_items]
+
+    try:
+        enhanced_prompt = _ENHANCED_PROMPT_PREFIX + prompt
+        key = hashlib.sha256(enhanced_prompt.encode()).hexdigest()
+        # The first filename matches the single-item path's so a prompt seen
+        # once alone and later in a batch shares its cached image
+        filenames = [f"{key}.png" if i == 0 else f"{key}_{i}.png"
+                     for i in range(len(action_items))]
+        filepaths = [os.path.join(IMAGE_DIR, name) for name in filenames]
+
+        lock = _prompt_lock(key)
+        async with lock:
+            if all(os.path.exists(path) for path in filepaths):
+                logger.debug("Prompt cache hit for batch of %s, reusing %s.png", len(action_items), key)
+                return [
+                    {
+                        "title": item["title"],
+                        "description": item["description"],
+                        "image_path": f"/static/generated_images/{name}"
+                    }
+                    for item, name in zip(action_items, filenames)
+                ]
+
+            url = "https://api.openai.com/v1/images/generations"
+            headers = {
+                "Authorization": f"Bearer {OPENAI_API_KEY}",
+                "Content-Type": "application/json"
+            }
+            data = {
+                "model": "gpt-image-1",
+                "prompt": enhanced_prompt,
+                "n": len(action_items),
+                "size": "1024x1024",
+                "quality": "medium",
+                "background": "opaque",
+                "output_format": "png"
+            }
+
+            logger.debug("Sending batched request for %s images", len(action_items))
+            response = await _CLIENT.post(url, headers=headers, json=data)
+            response_data = response.json()
+
+            if "data" not in response_data or not response_data["data"]:
+                logger.debug("No image data in batched OpenAI response: %s", response_data)
+                return placeholder
+
+            image_info = []
+            for (item, entry), filename, filepath in zip(
+                    zip(action_items, response_data["data"]), filenames, filepaths):
+                if "b64_json" not in entry:
+                    logger.debug("Unexpected entry in batched response: %s", entry)
+                    image_info.append({
+                        "title": item["title"],
+                        "description": item["description"],
+                        "image_path": "/static/generated_images/placeholder.png"
+                    })
+                    continue
+                # a2b_base64 is the direct C decode path; the memoryview hands
+                # the buffer to the writer without another copy
+                image_bytes = memoryview(a2b_base64(entry["b64_json"]))
+                async with aiofiles.open(filepath, "wb") as f:
+                    await f.write(image_bytes)
+                image_info.append({
+                    "title": item["title"],
+                    "description": item["description"],
+                    "image_path": f"/static/generated_images/{filename}"
+                })
+
+            # If the API returned fewer images than requested, pad with placeholders
+            for item in action_items[len(image_info):]:
+                image_info.append({
+                    "title": item["title"],
+                    "description": item["description"],
+                    "image_path": "/static/generated_images/placeholder.png"
+                })
+            return image_info
+
+    except Exception as e:
+        logger.warning("Exception in batched image generation: %s", str(e))
+        return placeholder
+
 async def generate_image_for_action(action_item: Dict[str, str], prompt: str) -> Dict[str, str]:
     """
     Generate an image for a specific action item using OpenAI's image generation API.
@@ -179,111 +386,111 @@ async def generate_image_for_action(action_item: Dict[str, str], prompt: str) ->
     Returns:
         Dictionary with action item info and image path
     """
-    # If no API key is available, return mock image path
-    if not OPENAI_API_KEY:
-        print("DEBUG: No OpenAI API key provided. Cannot generate images.")
-        return {
-            "title": action_item["title"],
-            "description": action_item["description"],
-            "image_path": "/static/generated_images/placeholder.png"
-        }
-    
     try:
-        # Generate a unique filename
-        filename = f"{uuid.uuid4()}.png"
-        filepath = os.path.join(IMAGE_DIR, filename)
-        
-        print(f"DEBUG: Will save image to {filepath}")
-        
-        # Prepare the API request
-        url = "https://api.openai.com/v1/images/generations"
-        headers = {
-            "Authorization": f"Bearer {OPENAI_API_KEY}",
-            "Content-Type": "application/json"
-        }
-        
         # Enhanced prompt for better healthcare/nutrition infographics
-        enhanced_prompt = f"""
-        Create a professional, clear infographic illustration for the specific nutrition recommendation below.
-        The image should:
-        - Show actual examples of the recommended foods/meals based solely on the recommendation context
-        - Use a soft color palette suitable for healthcare
-        - Be visually specific to the exact recommendation, not generic
-        - Include realistic food portions and combinations relevant to the health context
-        - Have a clean, minimalist design focused on the recommended foods
-        - No text overlay necessary (text will be added separately)
-        - Designed from the patient's perspective (what "I" should eat/do)
-        - Be specific to the patient's health context
-        
-        The specific nutritional recommendation is:
-        {prompt}
-        """
-        
-        print(f"DEBUG: Sending request to OpenAI image generation API")
-        
-        # Make the API request with updated parameters
-        data = {
-            "model": "gpt-image-1",
-            "prompt": enhanced_prompt,
-            "n": 1,
-            "size": "1024x1024",
-            "quality": "high",
-            "background": "opaque",
-            "output_format": "png"
-        }
-        
-        async with httpx.AsyncClient() as client:
-            response = await client.post(url, headers=headers, json=data, timeout=60.0)
-            response_data = response.json()
-        
-        print(f"DEBUG: Received response from OpenAI API")
-        
-        # Handle the response based on what's available
-        if "data" in response_data and len(response_data["data"]) > 0:
-            # For gpt-image-1 model which always returns base64-encoded images
-            if "b64_json" in response_data["data"][0]:
-                image_data = response_data["data"][0]["b64_json"]
-                image_bytes = base64.b64decode(image_data)
-            # Handle URL response format
-            elif "url" in response_data["data"][0]:
-                # Download the image from the provided URL
-                image_url = response_data["data"][0]["url"]
-                print(f"DEBUG: Downloading image from URL: {image_url}")
-                async with httpx.AsyncClient() as client:
-                    img_response = await client.get(image_url)
-                    image_bytes = img_response.content
-            else:
-                print(f"DEBUG: Unexpected response format: {response_data}")
+        enhanced_prompt = _ENHANCED_PROMPT_PREFIX + prompt
+
+        # Name the file after the prompt hash so identical prompts (across
+        # uploads or within one) reuse the already-generated image instead of
+        # paying another 10-30s OpenAI call
+        key = hashlib.sha256(enhanced_prompt.encode()).hexdigest()
+        filename = f"{key}.png"
+        filepath = os.path.join(IMAGE_DIR, filename)
+
+        # Hold the per-prompt lock across generation so a concurrent duplicate
+        # waits for the first call to finish and then reuses its file
+        lock = _prompt_lock(key)
+        async with lock:
+            if os.path.exists(filepath):
+                logger.debug("Prompt cache hit, reusing %s", filepath)
                 return {
                     "title": action_item["title"],
                     "description": action_item["description"],
-                    "image_path": "/static/generated_images/placeholder.png"
+                    "image_path": f"/static/generated_images/{filename}"
                 }
-            
-            with open(filepath, "wb") as f:
-                f.write(image_bytes)
-            
-            print(f"DEBUG: Successfully saved image to {filepath}")
-            
-            # Return information about the image
-            image_path = f"/static/generated_images/{filename}"
-            print(f"DEBUG: Returning image path: {image_path}")
-            
-            return {
-                "title": action_item["title"],
-                "description": action_item["description"],
-                "image_path": image_path
-            }
+            return await _request_and_save_image(action_item, enhanced_prompt, filename, filepath)
+
+    except Exception as e:
+        logger.warning("Exception in image generation: %s", str(e))
+        return {
+            "title": action_item["title"],
+            "description": action_item["description"],
+            "image_path": "/static/generated_images/placeholder.png"
+        }
+
+async def _request_and_save_image(action_item: Dict[str, str], enhanced_prompt: str,
+                                  filename: str, filepath: str) -> Dict[str, str]:
+    """Call the OpenAI image API for one prompt and save the result to disk."""
+    logger.debug("Will save image to %s", filepath)
+
+    # Prepare the API request
+    url = "https://api.openai.com/v1/images/generations"
+    headers = {
+        "Authorization": f"Bearer {OPENAI_API_KEY}",
+        "Content-Type": "application/json"
+    }
+
+    logger.debug("Sending request to OpenAI image generation API")
+
+    # Make the API request with updated parameters
+    data = {
+        "model": "gpt-image-1",
+        "prompt": enhanced_prompt,
+        "n": 1,
+        "size": "1024x1024",
+        "quality": "medium",
+        "background": "opaque",
+        "output_format": "png"
+    }
+
+    response = await _CLIENT.post(url, headers=headers, json=data)
+    response_data = response.json()
+
+    logger.debug("Received response from OpenAI API")
+
+    # Handle the response based on what's available
+    if "data" in response_data and len(response_data["data"]) > 0:
+        # For gpt-image-1 model which always returns base64-encoded images
+        if "b64_json" in response_data["data"][0]:
+            image_data = response_data["data"][0]["b64_json"]
+            # a2b_base64 is the direct C decode path; the memoryview hands
+            # the decoded buffer to the async writer without another copy
+            image_bytes = memoryview(a2b_base64(image_data))
+            # Write asynchronously so concurrent image tasks (and other
+            # requests) aren't stalled behind a ~1MB blocking disk write
+            async with aiofiles.open(filepath, "wb") as f:
+                await f.write(image_bytes)
+        # Handle URL response format
+        elif "url" in response_data["data"][0]:
+            # Download the image from the provided URL, streaming chunks
+            # straight to disk instead of buffering the whole PNG in memory
+            image_url = response_data["data"][0]["url"]
+            logger.debug("Downloading image from URL: %s", image_url)
+            async with _CLIENT.stream("GET", image_url) as img_response:
+                async with aiofiles.open(filepath, "wb") as f:
+                    async for chunk in img_response.aiter_bytes(65536):
+                        await f.write(chunk)
         else:
-            print(f"DEBUG: No image data in OpenAI response. Response data: {response_data}")
+            logger.debug("Unexpected response format: %s", response_data)
             return {
                 "title": action_item["title"],
                 "description": action_item["description"],
                 "image_path": "/static/generated_images/placeholder.png"
             }
-            
-    except Exception as e:
-        print(f"DEBUG: Exception in image generation: {str(e)}")
+
+        logger.debug("Successfully saved image to %s", filepath)
+
+        # Return information about the image
+        image_path = f"/static/generated_images/{filename}"
+        logger.debug("Returning image path: %s", image_path)
+
+        return {
+            "title": action_item["title"],
+            "description": action_item["description"],
+            "image_path": image_path
+        }
+    else:
+        logger.debug("No image data in OpenAI response. Response data: %s", response_data)
         return {
             "title": action_item["title"],
             "description": action_item["description"],
@@ -1,80 +1,125 @@
+import asyncio
+import hashlib
+import logging
 import os
-import json
 import re
+from collections import OrderedDict
 from typing import Dict, Any, List
 import httpx
+import msgspec
+import orjson
 from dotenv import load_dotenv
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 # Get OpenAI API key from environment variables
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 
-async def parse_adime_text(content: str) -> Dict[str, Any]:
+# Shared HTTP client: keeps an ALPN-negotiated HTTP/2 keep-alive connection
+# to api.openai.com instead of a fresh DNS + TCP + TLS handshake per parse
+_CLIENT = httpx.AsyncClient(
+    base_url="https://api.openai.com",
+    http2=True,
+    timeout=60.0,
+    limits=httpx.Limits(max_keepalive_connections=20, max_connections=100),
+)
+
+async def close_client():
+    """Close the shared HTTP client (called on app shutdown)."""
+    await _CLIENT.aclose()
+
+# Parsed-note cache keyed by content hash. Identical notes (retries,
+# duplicate uploads, test runs) skip the multi-second LLM round-trip and
+# its token cost entirely; bounded LRU so it can't grow without limit.
+_PARSE_CACHE: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+_PARSE_CACHE_SIZE = 512
+
+# Section headers recognized by the rule-based fallback splitter; the bytes
+# variant drives the ASCII fast path in _split_sections
+_HEADER_RE = re.compile(r"(?i)\b(ASSESSMENT|DIAGNOSIS|INTERVENTION|MONITORING)\b[:\s]+")
+_HEADER_BRE = re.compile(rb"(?i)\b(ASSESSMENT|DIAGNOSIS|INTERVENTION|MONITORING)\b[:\s]+")
+
+def _split_sections(content: str) -> Dict[str, str]:
     """
-    Parse any text into structured ADIME data using OpenAI's GPT-4.
-    
+    Split a note into its ADIME sections in one linear pass.
+
+    Locates every section header with a single finditer scan and slices the
+    text between consecutive headers, rather than running a backtracking
+    DOTALL search per section over the whole note. ASCII notes (the common
+    case) are matched over bytes, which runs a tighter loop in the regex
+    engine; byte offsets equal character offsets there, so the slices of
+    the original string stay correct.
+
     Args:
-        content: Raw text content to be parsed
-        
+        content: Raw note text
+
     Returns:
-        Structured data dictionary with Assessment, Diagnosis, Intervention, and Monitoring sections
+        Mapping of lowercase section name to the text under that header
     """
-    # Use OpenAI API for parsing
-    if not OPENAI_API_KEY:
-        raise ValueError("OpenAI API key is required but not found in environment variables")
-    
-    try:
-        # Process with OpenAI, regardless of input format
-        structured_data = await parse_with_openai(content)
-        return structured_data
-    except Exception as e:
-        print(f"Error using OpenAI API: {e}")
-        # Return empty structure if parsing fails
-        return {
-            "assessment": {"summary": "Could not parse content", "weight": "", "labs": [], "current_intake": ""},
-            "diagnosis": {"problems": [], "summary": "Could not parse content"},
-            "intervention": {"summary": "Could not parse content", "short_term_goals": [], "long_term_goals": [], "action_items": []},
-            "monitoring": {"follow_up": "Could not parse content", "metrics": [], "timeline": ""}
-        }
+    if content.isascii():
+        matches = list(_HEADER_BRE.finditer(content.encode()))
+        names = [m.group(1).decode("ascii").lower() for m in matches]
+    else:
+        matches = list(_HEADER_RE.finditer(content))
+        names = [m.group(1).lower() for m in matches]
 
-async def parse_with_openai(content: str) -> Dict[str, Any]:
+    sections: Dict[str, str] = {}
+    for i, match in enumerate(matches):
+        end = matches[i + 1].start() if i + 1 < len(matches) else len(content)
+        # Keep the first occurrence if a header word repeats in the narrative
+        sections.setdefault(names[i], content[match.end():end].strip())
+    return sections
+
+# Bullet markers at line starts. A linear split keeps tokenizing O(n);
+# the lazy-capture-with-lookahead alternative re-scans quadratically on
+# long intervention text.
+_BULLET_SPLIT_RE = re.compile(r"(?:^|\n)\s*(?:\d+\.|•|\*|-)\s*")
+_CLAUSE_SPLIT_RE = re.compile(r"[.;:]")
+
+def _extract_action_items(intervention_text: str) -> List[Dict[str, str]]:
     """
-    Use OpenAI's API to parse any text into structured ADIME data.
-    
+    Pull bulleted or numbered items out of intervention text.
+
     Args:
-        content: Raw text content
-        
+        intervention_text: Text of the intervention section
+
     Returns:
-        Structured data dictionary
+        Action item dictionaries with title and description
     """
-    # Prepare the API request
-    url = "https://api.openai.com/v1/chat/completions"
-    headers = {
-        "Authorization": f"Bearer {OPENAI_API_KEY}",
-        "Content-Type": "application/json"
-    }
-    
-    # Prepare the prompt
-    prompt = f"""
+    items = []
+    # Skip the first chunk: it is whatever text precedes the first bullet
+    for part in _BULLET_SPLIT_RE.split(intervention_text)[1:]:
+        text = " ".join(part.split())
+        if not text:
+            continue
+        # First clause as the title, full bullet as the description
+        title = _CLAUSE_SPLIT_RE.split(text, maxsplit=1)[0].strip()[:80]
+        items.append({"title": title or text[:80], "description": text})
+    return items
+
+# Parsing prompt built once at import; only the note text varies per call,
+# so a single str.replace beats re-interpolating the ~3 KB literal
+_PROMPT_TEMPLATE = """
     Parse the following text into a structured ADIME (Assessment, Diagnosis, Intervention, Monitoring/Evaluation) format.
     
     Analyze the content to identify key information that would fit into each ADIME category, even if the original text isn't explicitly structured this way.
     If the text is already in ADIME format, maintain that structure but extract data in a more structured way.
     
     TEXT TO PARSE:
-    {content}
+    __CONTENT__
     
     Return a JSON object with the following structure, focusing on extracting EXACTLY what's in the text:
-    {{
-        "patient_info": {{
+    {
+        "patient_info": {
             "name": "Extract resident/patient name if present",
             "date": "Extract date if present",
             "time": "Extract time if present",
             "rd_name": "Extract dietitian name if present",
             "additional_fields": [] // Any other patient-related fields found that don't fit the above categories
-        }},
-        "assessment": {{
+        },
+        "assessment": {
             // Extract ONLY fields that actually appear in the text, but use these common fields if they exist:
             "age": null,
             "gender": null,
@@ -117,53 +162,53 @@ async def parse_with_openai(content: str) -> Dict[str, Any]:
             "needs_met": null,
             // Dynamic fields - detect any assessment-related fields not covered above
             "additional_fields": [
-                // Example: {{"name": "Field Name", "value": "Field Value"}}
+                // Example: {"name": "Field Name", "value": "Field Value"}
             ],
             // Group any additional assessment data by category if detected in the text
             "categories": [
-                // Example: {{"name": "Category Name", "fields": [{{"name": "Field Name", "value": "Field Value"}}]}}
+                // Example: {"name": "Category Name", "fields": [{"name": "Field Name", "value": "Field Value"}]}
             ],
             "summary": "A concise summary of the patient's current health status"
-        }},
-        "diagnosis": {{
+        },
+        "diagnosis": {
             "content": "The full nutrition diagnosis statement if present",
             "problems": ["List of nutrition problems mentioned in the text"],
             "goals": ["List of nutrition goals mentioned in the text"],
             "additional_fields": [
-                // Example: {{"name": "Field Name", "value": "Field Value"}}
+                // Example: {"name": "Field Name", "value": "Field Value"}
             ],
             "summary": "Summary of nutrition issues described in the text"
-        }},
-        "intervention": {{
+        },
+        "intervention": {
             "content": "The full intervention section if present as text",
             "summary": "Summary of nutrition recommendations mentioned in the text",
             "short_term_goals": ["Short-term goals mentioned in the text"],
             "long_term_goals": ["Longer-term goals mentioned in the text"],
             "additional_fields": [
-                // Example: {{"name": "Field Name", "value": "Field Value"}}
+                // Example: {"name": "Field Name", "value": "Field Value"}
             ],
             "action_items": [
-                {{ 
+                { 
                     "title": "Title for a specific intervention mentioned in the text", 
                     "description": "Description of this intervention",
                     "visualization_prompt": "Create a simple, clear infographic that illustrates: [intervention from the text]"
-                }}
+                }
             ]
-        }},
-        "monitoring": {{
+        },
+        "monitoring": {
             "content": "The full monitoring/evaluation section if present as text",
             "follow_up": "Follow-up plans mentioned in the text",
             "metrics": ["Metrics for measuring progress mentioned in the text"],
             "timeline": "Timeline for monitoring mentioned in the text",
             "additional_fields": [
-                // Example: {{"name": "Field Name", "value": "Field Value"}}
+                // Example: {"name": "Field Name", "value": "Field Value"}
             ]
-        }},
+        },
         // Include any additional sections found in the text that don't fit into traditional ADIME
         "additional_sections": [
-            // Example: {{"title": "Section Title", "content": "Section content"}}
+            // Example: {"title": "Section Title", "content": "Section content"}
         ]
-    }}
+    }
     
     Important guidelines:
     1. Focus on extracting EXACTLY what's in the text, not generating new content
@@ -172,33 +217,167 @@ async def parse_with_openai(content: str) -> Dict[str, Any]:
     4. If you detect additional categories or sections, include them appropriately
     5. Preserve the exact terminology used in the source text
     """
+
+# Typed view of the chat completion envelope: msgspec decodes straight into
+# these structs and skips every field we don't declare (usage, model, id,
+# logprobs, ...), so no throwaway dicts are built just to reach the content
+class _Message(msgspec.Struct):
+    content: str
+
+class _Choice(msgspec.Struct):
+    message: _Message
+
+class _ChatCompletion(msgspec.Struct):
+    choices: List[_Choice]
+
+_COMPLETION_DECODER = msgspec.json.Decoder(_ChatCompletion)
+
+_SYSTEM_MSG = "You are a clinical nutrition data extraction system that organizes health and nutrition text into structured ADIME data. You extract exactly what is mentioned in the text with minimal interpretation. Focus on capturing the full range of information in the text, including any unusual fields or sections that may not fit standard schemas. Always return null for fields not present rather than making assumptions."
+
+async def parse_adime_text(content: str) -> Dict[str, Any]:
+    """
+    Parse any text into structured ADIME data using OpenAI's GPT-4.
+    
+    Args:
+        content: Raw text content to be parsed
+        
+    Returns:
+        Structured data dictionary with Assessment, Diagnosis, Intervention, and Monitoring sections
+    """
+    # Use OpenAI API for parsing
+    if not OPENAI_API_KEY:
+        raise ValueError("OpenAI API key is required but not found in environment variables")
+    
+    try:
+        # Serve repeat notes from the cache before going to the API
+        key = hashlib.blake2b(content.encode(), digest_size=16).hexdigest()
+        cached = _PARSE_CACHE.get(key)
+        if cached is not None:
+            _PARSE_CACHE.move_to_end(key)
+            return cached
+
+        # Process with OpenAI, regardless of input format
+        structured_data = await parse_with_openai(content)
+        _PARSE_CACHE[key] = structured_data
+        if len(_PARSE_CACHE) > _PARSE_CACHE_SIZE:
+            _PARSE_CACHE.popitem(last=False)
+        return structured_data
+    except Exception as e:
+        logger.warning("Error using OpenAI API: %s", e)
+        # Fall back to a rule-based split so the report still shows the
+        # note's own sections rather than empty placeholders
+        sections = _split_sections(content)
+        return {
+            "assessment": {"summary": sections.get("assessment", "Could not parse content"), "weight": "", "labs": [], "current_intake": ""},
+            "diagnosis": {"problems": [], "summary": sections.get("diagnosis", "Could not parse content")},
+            "intervention": {"summary": sections.get("intervention", "Could not parse content"), "short_term_goals": [], "long_term_goals": [], "action_items": _extract_action_items(sections.get("intervention", ""))},
+            "monitoring": {"follow_up": sections.get("monitoring", "Could not parse content"), "metrics": [], "timeline": ""}
+        }
+
+async def parse_adime_batch(contents: List[str]) -> List[Dict[str, Any]]:
+    """
+    Parse several ADIME notes in a single OpenAI round trip.
+
+    Sends all notes in one chat completion with numbered delimiters, so a
+    batch upload pays for one HTTPS exchange instead of one per note and the
+    schema instructions in the prompt are shared across items. Falls back to
+    per-note parsing (concurrently, over the pooled client) if the combined
+    request fails or the reply doesn't line up with the input count.
+
+    Args:
+        contents: Raw note texts to parse
+
+    Returns:
+        One structured data dictionary per input note, in order
+    """
+    if not contents:
+        return []
+    if len(contents) == 1:
+        return [await parse_adime_text(contents[0])]
+
+    if not OPENAI_API_KEY:
+        raise ValueError("OpenAI API key is required but not found in environment variables")
+
+    numbered = "\n\n".join(
+        f"=== NOTE {i + 1} ===\n{content}" for i, content in enumerate(contents)
+    )
+    batch_wrapper = (
+        f"The text below contains {len(contents)} separate notes, delimited by "
+        '"=== NOTE n ===" markers. Parse EACH note independently and return a '
+        'JSON object of the form {"notes": [<parsed note 1>, <parsed note 2>, ...]}, '
+        "in the same order as the input, where each element follows the structure "
+        "described below.\n\n" + numbered
+    )
+    prompt = _PROMPT_TEMPLATE.replace("__CONTENT__", batch_wrapper)
+
+    try:
+        data = {
+            "model": "gpt-4o",
+            "messages": [
+                {"role": "system", "content": _SYSTEM_MSG},
+                {"role": "user", "content": prompt}
+            ],
+            "response_format": {"type": "json_object"},
+            "temperature": 0.1
+        }
+        headers = {
+            "Authorization": f"Bearer {OPENAI_API_KEY}",
+            "Content-Type": "application/json"
+        }
+        response = await _CLIENT.post("/v1/chat/completions", headers=headers, json=data)
+        content = _COMPLETION_DECODER.decode(response.content).choices[0].message.content
+        notes = orjson.loads(content).get("notes", [])
+        if len(notes) == len(contents):
+            return notes
+        logger.warning("Batch parse returned %s notes for %s inputs, retrying per note", len(notes), len(contents))
+    except Exception as e:
+        logger.warning("Error batch parsing with OpenAI API: %s", e)
+
+    # Per-note fallback still overlaps the round trips on the shared client
+    return list(await asyncio.gather(*(parse_adime_text(c) for c in contents)))
+
+async def parse_with_openai(content: str) -> Dict[str, Any]:
+    """
+    Use OpenAI's API to parse any text into structured ADIME data.
+    
+    Args:
+        content: Raw text content
+        
+    Returns:
+        Structured data dictionary
+    """
+    # Prepare the API request
+    url = "/v1/chat/completions"
+    headers = {
+        "Authorization": f"Bearer {OPENAI_API_KEY}",
+        "Content-Type": "application/json"
+    }
+    
+    # Prepare the prompt
+    prompt = _PROMPT_TEMPLATE.replace("__CONTENT__", content)
     
     # Make the API request
     data = {
         "model": "gpt-4o",
         "messages": [
-            {"role": "system", "content": "You are a clinical nutrition data extraction system that organizes health and nutrition text into structured ADIME data. You extract exactly what is mentioned in the text with minimal interpretation. Focus on capturing the full range of information in the text, including any unusual fields or sections that may not fit standard schemas. Always return null for fields not present rather than making assumptions."},
+            {"role": "system", "content": _SYSTEM_MSG},
             {"role": "user", "content": prompt}
         ],
+        # JSON mode: the API guarantees the reply is a bare JSON object,
+        # so no prose stripping is needed on our side
+        "response_format": {"type": "json_object"},
         "temperature": 0.1
     }
     
-    async with httpx.AsyncClient() as client:
-        response = await client.post(url, headers=headers, json=data, timeout=60.0)
-        response_data = response.json()
-    
+    response = await _CLIENT.post(url, headers=headers, json=data)
+
     # Parse the response
     try:
-        content = response_data["choices"][0]["message"]["content"]
-        # Extract JSON from the response (in case there's any additional text)
-        json_match = re.search(r"({.*})", content, re.DOTALL)
-        if json_match:
-            json_str = json_match.group(1)
-            result = json.loads(json_str)
-            return result
-        else:
-            # If no JSON pattern found, try parsing the whole content
-            return json.loads(content)
-    except (json.JSONDecodeError, KeyError) as e:
-        print(f"Error parsing OpenAI response: {e}")
-        raise 
\ No newline at end of file
+        # Typed decode of the envelope pulls out just choices[].message.content
+        # without materializing dicts for the rest of the payload
+        content = _COMPLETION_DECODER.decode(response.content).choices[0].message.content
+        # response_format=json_object means the content is raw JSON
+        return orjson.loads(content)
+    except (msgspec.DecodeError, orjson.JSONDecodeError, IndexError) as e:
+        logger.warning("Error parsing OpenAI response: %s", e)
+        raise
\ No newline at end of file
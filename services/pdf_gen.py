@@ -1,142 +1,51 @@
+import asyncio
+import functools
+import hashlib
+import io
+import logging
 import os
-import uuid
-import tempfile
+import secrets
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
+import anyio
+import anyio.to_thread
+import lxml.html as lxml_html
 from weasyprint import HTML, CSS
-from jinja2 import Environment, FileSystemLoader
+from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader
 from typing import Optional
 import re
 from datetime import datetime
 
+logger = logging.getLogger(__name__)
+
 # Set the directory for PDF storage
 PDF_DIR = "static/pdfs"
 
+# The working directory never changes after startup; resolve it and the
+# file:// base URL once instead of a getcwd() syscall per PDF
+_CWD = os.getcwd()
+_BASE_URL = f"file://{_CWD}/"
+
 # Create directory if it doesn't exist
 os.makedirs(PDF_DIR, exist_ok=True)
 
-async def generate_pdf(html_content: str) -> str:
-    """
-    Generate a PDF from HTML content.
-    
-    Args:
-        html_content: HTML content to convert to PDF
-        
-    Returns:
-        Path to the generated PDF file
-    """
-    # DEBUG: Print first 300 chars of HTML content
-    print(f"DEBUG: HTML content length: {len(html_content)}")
-    print(f"DEBUG: HTML content preview: {html_content[:300]}...")
-    
-    # DEBUG: Check for image tags in the HTML
-    img_tags = re.findall(r'<img[^>]*src="([^"]*)"[^>]*>', html_content)
-    print(f"DEBUG: Found {len(img_tags)} images in HTML:")
-    for i, img in enumerate(img_tags[:5]):  # Print first 5 images
-        print(f"DEBUG: Image {i}: {img}")
-    
-    # Fix image paths directly in the HTML content
-    # This is a more direct approach than relying on base_url
-    cwd = os.getcwd()
-    for img_src in img_tags:
-        if img_src.startswith('/'):
-            # Convert /static/... to absolute file path
-            rel_path = img_src[1:]  # Remove leading slash
-            abs_path = os.path.join(cwd, rel_path)
-            file_url = f"file://{abs_path}"
-            # Replace in HTML
-            html_content = html_content.replace(f'src="{img_src}"', f'src="{file_url}"')
-            print(f"DEBUG: Replaced image path {img_src} with {file_url}")
-    
-    # Cleanup HTML - remove any empty or unnecessary elements
-    # Remove buttons and other control elements that shouldn't be in the PDF
-    html_content = re.sub(r'<button[^>]*>.*?</button>', '', html_content)
-    
-    # Remove any elements with display:none style
-    html_content = re.sub(r'<[^>]*style="[^"]*display:\s*none[^"]*"[^>]*>.*?</[^>]*>', '', html_content)
-    
-    # Remove empty editor divs (those with just <p><br></p> or similar)
-    html_content = re.sub(r'<div[^>]*class="[^"]*editor[^"]*"[^>]*>\s*<p>\s*<br>\s*</p>\s*</div>', '', html_content)
-    
-    # Check if the replacement worked
-    fixed_img_tags = re.findall(r'<img[^>]*src="([^"]*)"[^>]*>', html_content)
-    print(f"DEBUG: After fixing, found {len(fixed_img_tags)} images in HTML:")
-    for i, img in enumerate(fixed_img_tags[:5]):
-        print(f"DEBUG: Fixed Image {i}: {img}")
-    
-    # Check if image files actually exist
-    for i, img_src in enumerate(img_tags[:5]):
-        # Handle both absolute URLs and paths
-        if img_src.startswith('http'):
-            print(f"DEBUG: Image {i} is a remote URL: {img_src}")
-        else:
-            # Extract path from the URL format if needed
-            local_path = img_src
-            if img_src.startswith('file://'):
-                local_path = img_src[7:]
-            elif img_src.startswith('http://localhost') or img_src.startswith('https://localhost'):
-                local_path = re.sub(r'^https?://localhost(:\d+)?', '', img_src)
-            
-            # For absolute paths starting with /, make them relative to the current directory
-            if local_path.startswith('/'):
-                local_path = local_path[1:]  # Remove leading slash
-                
-            # Check if file exists
-            if os.path.exists(local_path):
-                print(f"DEBUG: Image {i} exists at path: {local_path}")
-                # Get file size
-                file_size = os.path.getsize(local_path)
-                print(f"DEBUG: Image file size: {file_size} bytes")
-            else:
-                print(f"DEBUG: Image {i} DOES NOT EXIST at path: {local_path}")
-                # Try to find the closest matching file
-                dir_path = os.path.dirname(local_path) or '.'
-                if os.path.exists(dir_path):
-                    print(f"DEBUG: Directory exists: {dir_path}")
-                    files = os.listdir(dir_path)
-                    print(f"DEBUG: Files in directory: {files[:10]}")
-                else:
-                    print(f"DEBUG: Directory does not exist: {dir_path}")
-    
-    # Fix relative paths for images
-    # Replace relative paths that don't start with http/https
-    # First, get the absolute path of the current working directory
-    cwd = os.getcwd()
-    base_url = f"file://{cwd}/"
-    print(f"DEBUG: Base URL for images: {base_url}")
-    print(f"DEBUG: Current working directory: {cwd}")
-    
-    # Check for static directory
-    if os.path.exists('static/generated_images'):
-        print(f"DEBUG: Found static/generated_images directory")
-        img_files = os.listdir('static/generated_images')
-        print(f"DEBUG: Files in static/generated_images: {img_files[:10]}")
-    else:
-        print(f"DEBUG: static/generated_images directory NOT found")
-    
-    # Create a unique filename for the PDF
-    filename = f"{uuid.uuid4()}.pdf"
-    filepath = os.path.join(PDF_DIR, filename)
-    
-    try:
-        # Save original HTML content to file for debugging
-        debug_html_path = os.path.join(PDF_DIR, f"debug_{uuid.uuid4()}.html")
-        with open(debug_html_path, 'w', encoding='utf-8') as debug_file:
-            debug_file.write(html_content)
-        print(f"DEBUG: Saved original HTML content to {debug_html_path} for inspection")
-        
-        # Write the HTML content to a temporary file
-        with tempfile.NamedTemporaryFile(suffix='.html', delete=False) as temp:
-            temp.write(html_content.encode('utf-8'))
-            temp_path = temp.name
-        
-        print(f"DEBUG: Wrote HTML to temporary file: {temp_path}")
-        
-        # Convert HTML to PDF with base URL to resolve relative paths
-        html = HTML(filename=temp_path, base_url=base_url)
-        print(f"DEBUG: Created HTML object for WeasyPrint with base_url: {base_url}")
-        
-        # Custom CSS for PDF rendering
-        css = CSS(string="""
+# Long-lived Jinja environment: templates are read, parsed and compiled
+# once and then served from the environment's template cache, instead of
+# rebuilding an Environment (and recompiling) per render. The bytecode
+# cache (shared with the app's template env) skips even the first-render
+# compile after a restart.
+Path(".jinja_cache").mkdir(exist_ok=True)
+_JINJA_ENV = Environment(
+    loader=FileSystemLoader("templates"),
+    auto_reload=False,
+    cache_size=400,
+    bytecode_cache=FileSystemBytecodeCache(directory=".jinja_cache"),
+)
+
+# Stylesheet for PDF rendering, parsed once at import: WeasyPrint CSS
+# objects are immutable after parse, so every render reuses the same one
+_PDF_CSS_STR = """
             @page {
                 margin: 2cm 1.5cm;
                 @top-center {
@@ -215,21 +124,14 @@ async def generate_pdf(html_content: str) -> str:
                 margin-bottom: 10px;
             }
             /* Hide any elements that might be causing empty boxes */
-            .ql-editor:empty, 
-            .editor:empty, 
+            .editor:empty,
             div:empty {
                 display: none !important;
                 margin: 0 !important;
                 padding: 0 !important;
                 height: 0 !important;
             }
-            
-            /* Remove Quill editor-specific styling */
-            .ql-container, .ql-editor {
-                border: none !important;
-                padding: 0 !important;
-            }
-            
+
             /* Style list elements */
             ul, ol {
                 margin-top: 5px;
@@ -245,49 +147,392 @@ async def generate_pdf(html_content: str) -> str:
             .add-field-btn, .remove-field-btn, .add-subsection-btn, .add-section-btn, .section-actions, .add-field-container {
                 display: none !important;
             }
-            
+        """
+_PDF_CSS = CSS(string=_PDF_CSS_STR)
+
+# Optional rule blocks, applied only when their marker class actually occurs
+# in the document. WeasyPrint matches every selector against every element,
+# so dead selectors (Quill chrome, custom-field styling on a report with no
+# custom fields) cost real time on large documents.
+_CSS_FRAGMENTS = {
+    'ql-': """
+            /* Remove Quill editor-specific styling */
+            .ql-container, .ql-editor {
+                border: none !important;
+                padding: 0 !important;
+            }
+            .ql-editor:empty {
+                display: none !important;
+                margin: 0 !important;
+                padding: 0 !important;
+                height: 0 !important;
+            }
+        """,
+    'custom-fields-': """
             /* Style custom fields */
-            .custom-fields-patient p, 
-            .custom-fields-demographics p,
-            .custom-fields-dietary p,
-            .custom-fields-diet p,
-            .custom-fields-medical p,
-            .custom-fields-nfpe p,
-            .custom-fields-muscle p,
-            .custom-fields-hydration p,
-            .custom-fields-nutrition p,
             [class^="custom-fields-"] p {
                 margin: 5px 0;
             }
-            
+        """,
+    'custom-subsections-': """
             /* Style custom subsections */
             [id^="custom-subsections-"] .subsection {
                 margin-top: 15px;
                 margin-bottom: 15px;
             }
-            
+        """,
+    'custom-sections': """
             /* Style custom sections */
             #custom-sections .section {
                 margin-bottom: 30px;
             }
-        """)
-        
-        print(f"DEBUG: About to generate PDF at {filepath}")
-        
-        # Generate the PDF
-        html.write_pdf(filepath, stylesheets=[css])
-        
-        print(f"DEBUG: Successfully generated PDF at {filepath}")
-        
-        # Clean up the temporary file
-        os.unlink(temp_path)
+        """,
+}
+_CSS_FRAGMENT_MARKERS = [(marker, marker.encode()) for marker in _CSS_FRAGMENTS]
+
+@functools.lru_cache(maxsize=16)
+def _stylesheets_for(markers: frozenset):
+    """Base stylesheet plus the parsed fragments for the given markers."""
+    if not markers:
+        return [_PDF_CSS]
+    extra = "".join(_CSS_FRAGMENTS[marker] for marker in sorted(markers))
+    return [_PDF_CSS, CSS(string=extra)]
+
+def _select_stylesheets(html_bytes: bytes):
+    """Pick the stylesheet set matching the classes present in the document."""
+    present = frozenset(
+        marker for marker, needle in _CSS_FRAGMENT_MARKERS if needle in html_bytes
+    )
+    return _stylesheets_for(present)
+
+_DISPLAY_NONE_RE = re.compile(r'display:\s*none')
+_IMG_TAG_RE = re.compile(r'<img[^>]*src="([^"]*)"[^>]*>')
+_LOCALHOST_RE = re.compile(r'^https?://localhost(:\d+)?')
+
+# Images wider than this are downsampled before rendering. Full-width
+# content is ~17cm printable at 150 DPI (~1000px); 1.5x that keeps headroom
+# for zooming without embedding multi-megapixel originals in the PDF.
+_MAX_IMG_WIDTH = 1536
+_RESCALED_DIR = f"{PDF_DIR}/_rescaled"
+
+@functools.lru_cache(maxsize=256)
+def _downsampled_path(local_path: str) -> str:
+    """
+    Path to a downsampled copy of an image, or the original if small enough.
+
+    Oversized images dominate both write_pdf time (re-encode + Flate) and
+    output size; scaling them once to _MAX_IMG_WIDTH and caching the result
+    next to the PDFs means every later render embeds the small copy. Falls
+    back to the original path if Pillow is unavailable or the file can't be
+    read.
+
+    Args:
+        local_path: Image path relative to the working directory
+
+    Returns:
+        Path (relative to the working directory) to embed in the PDF
+    """
+    try:
+        from PIL import Image
+    except ImportError:
+        return local_path
+    try:
+        with Image.open(local_path) as img:
+            if img.width <= _MAX_IMG_WIDTH:
+                return local_path
+            digest = hashlib.blake2b(local_path.encode(), digest_size=8).hexdigest()
+            out_path = f"{_RESCALED_DIR}/{digest}.png"
+            if not os.path.exists(out_path):
+                os.makedirs(_RESCALED_DIR, exist_ok=True)
+                height = round(img.height * _MAX_IMG_WIDTH / img.width)
+                img.resize((_MAX_IMG_WIDTH, height)).save(out_path)
+            logger.debug("Downsampled %s (%spx wide) to %s", local_path, img.width, out_path)
+            return out_path
+    except OSError:
+        return local_path
+
+def _preprocess_html(html_content: str):
+    """
+    Rewrite image srcs and strip UI chrome in one parse of the document.
+
+    libxml2 parses the HTML once; a single tree walk then turns site-absolute
+    /static/... image srcs into file:// URLs WeasyPrint can load, and drops
+    buttons, display:none elements and empty editor divs. This replaces a
+    regex pipeline that walked the full document string once per pattern
+    (and once per image for the src rewrite).
+
+    Args:
+        html_content: Raw HTML from the editor
+
+    Returns:
+        Tuple of (cleaned lxml tree, list of original img src values)
+    """
+    tree = lxml_html.document_fromstring(html_content)
+    img_srcs = []
+    doomed = []
+    for el in tree.iter():
+        tag = el.tag
+        if tag == 'img':
+            src = el.get('src')
+            if not src:
+                continue
+            img_srcs.append(src)
+            if src.startswith('/'):
+                # Oversized originals get swapped for a cached downsampled copy
+                local_path = _downsampled_path(src[1:])
+                el.set('src', f"file://{_CWD}/{local_path}")
+                logger.debug("Replaced image path %s with file://%s/%s", src, _CWD, local_path)
+        elif tag == 'button':
+            doomed.append(el)
+        elif _DISPLAY_NONE_RE.search(el.get('style') or ''):
+            doomed.append(el)
+        elif (tag == 'div' and 'editor' in (el.get('class') or '')
+              and not el.text_content().strip()
+              and next(el.iter('img'), None) is None):
+            # Empty editor divs - just a <p><br></p> placeholder inside.
+            # A div whose only content is an image is not empty: image-only
+            # editor sections must survive into the PDF.
+            doomed.append(el)
+    for el in doomed:
+        if el.getparent() is not None:
+            # drop_tree rejoins the element's tail text to the previous
+            # sibling, so text following a stripped element survives
+            el.drop_tree()
+    return tree, img_srcs
+
+# Keeps strong references to in-flight debug dump tasks so the event loop
+# doesn't garbage-collect them mid-write
+_DEBUG_DUMP_TASKS: set = set()
+
+def _write_debug_html(path: str, html_bytes: bytes) -> None:
+    with open(path, 'wb') as debug_file:
+        debug_file.write(html_bytes)
+    logger.debug("Saved original HTML content to %s for inspection", path)
+
+# Rendered-PDF cache keyed by cleaned-document hash: reopening the same
+# report (unchanged edits, browser retry) returns the file already on disk
+# instead of paying for another WeasyPrint run. Bounded LRU, like the parse
+# cache in parse_adime.
+_PDF_CACHE: "OrderedDict[str, str]" = OrderedDict()
+_PDF_CACHE_SIZE = 128
+
+# Bounded pool for PDF renders: WeasyPrint's cairo/pango internals release
+# the GIL, so renders genuinely run in parallel across cores, but each one
+# holds the full document tree in memory - cap them at the core count.
+# Created lazily: anyio 3.x CapacityLimiter asks sniffio for the running
+# async library at construction, so building it at import would crash any
+# synchronous import of this module (python main.py, gunicorn preload).
+_RENDER_LIMITER: Optional[anyio.CapacityLimiter] = None
+
+def _get_render_limiter() -> anyio.CapacityLimiter:
+    global _RENDER_LIMITER
+    if _RENDER_LIMITER is None:
+        _RENDER_LIMITER = anyio.CapacityLimiter(os.cpu_count() or 4)
+    return _RENDER_LIMITER
+
+@functools.lru_cache(maxsize=1024)
+def _stat_size(path: str):
+    """File size in bytes, or None if missing; cached to avoid re-stat()ing
+    the same static assets on every debug probe."""
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return None
+
+@functools.lru_cache(maxsize=64)
+def _cached_listdir(dir_path: str):
+    """Directory listing snapshot for debug output, cached per directory."""
+    try:
+        return tuple(os.listdir(dir_path))
+    except OSError:
+        return None
+
+def _debug_probe_images(img_tags, html_content: str) -> None:
+    """Log whether referenced images resolve on disk (DEBUG level only)."""
+    fixed_img_tags = _IMG_TAG_RE.findall(html_content)
+    logger.debug("After fixing, found %s images in HTML:", len(fixed_img_tags))
+    for i, img in enumerate(fixed_img_tags[:5]):
+        logger.debug("Fixed Image %s: %s", i, img)
+
+    for i, img_src in enumerate(img_tags[:5]):
+        # Handle both absolute URLs and paths
+        if img_src.startswith('http'):
+            logger.debug("Image %s is a remote URL: %s", i, img_src)
+            continue
+        # Extract path from the URL format if needed
+        local_path = img_src
+        if img_src.startswith('file://'):
+            local_path = img_src[7:]
+        elif img_src.startswith('http://localhost') or img_src.startswith('https://localhost'):
+            local_path = _LOCALHOST_RE.sub('', img_src)
+
+        # For absolute paths starting with /, make them relative to the current directory
+        if local_path.startswith('/'):
+            local_path = local_path[1:]
+
+        size = _stat_size(local_path)
+        if size is not None:
+            logger.debug("Image %s exists at path: %s", i, local_path)
+            logger.debug("Image file size: %s bytes", size)
+        else:
+            logger.debug("Image %s DOES NOT EXIST at path: %s", i, local_path)
+            dir_path = os.path.dirname(local_path) or '.'
+            files = _cached_listdir(dir_path)
+            if files is not None:
+                logger.debug("Files in directory %s: %s", dir_path, files[:10])
+            else:
+                logger.debug("Directory does not exist: %s", dir_path)
+
+    generated = _cached_listdir('static/generated_images')
+    if generated is not None:
+        logger.debug("Files in static/generated_images: %s", generated[:10])
+    else:
+        logger.debug("static/generated_images directory NOT found")
+
+# Shared image cache handed to every render: WeasyPrint keys it by image
+# URL, so the placeholder/report images that appear in every PDF are fetched
+# and decoded once per process instead of once per document
+_WP_CACHE: dict = {}
+
+def _render_pdf_into(html_bytes: bytes, filepath: str) -> None:
+    """Synchronous WeasyPrint render straight into a buffered file.
+
+    Meant to run in a worker thread. Writing through a large-buffered file
+    object instead of collecting the whole PDF in a BytesIO keeps peak
+    memory at roughly one buffer rather than the full document, which
+    matters for long image-heavy reports.
+    """
+    html = HTML(file_obj=io.BytesIO(html_bytes), base_url=_BASE_URL, encoding='utf-8')
+    with open(filepath, 'wb', buffering=1 << 20) as target:
+        html.write_pdf(target, stylesheets=_select_stylesheets(html_bytes), cache=_WP_CACHE)
+
+# Process pool for batch renders, created on first use: a single render is
+# largely GIL-held Python work inside WeasyPrint, so a batch of N PDFs only
+# saturates N cores when each renders in its own interpreter. Workers import
+# this module and reuse its parsed _PDF_CSS across jobs.
+_RENDER_POOL: Optional[ProcessPoolExecutor] = None
+
+def _prepare_pdf(html_content: str, filepath: str):
+    """Clean, serialize and render one document, meant for a worker thread.
+
+    Bundles the whole pipeline - including the Pillow downsampling that can
+    run during the tree walk - so none of it touches the event loop.
+
+    Returns:
+        Tuple of (original img src values, cleaned document bytes) for the
+        caller's debug output
+    """
+    tree, img_srcs = _preprocess_html(html_content)
+    html_bytes = lxml_html.tostring(tree, encoding='utf-8')
+    _render_pdf_into(html_bytes, filepath)
+    return img_srcs, html_bytes
+
+def _render_pdf_to_file(html_content: str, filepath: str) -> str:
+    """Clean, render and persist one PDF; module-level so the pool can pickle it."""
+    _prepare_pdf(html_content, filepath)
+    return filepath
+
+async def generate_pdfs_batch(html_contents: list) -> list:
+    """
+    Generate several PDFs in parallel across CPU cores.
+
+    Args:
+        html_contents: HTML documents to convert, one per PDF
+
+    Returns:
+        Paths to the generated PDF files, in input order ("" on failure)
+    """
+    global _RENDER_POOL
+    if not html_contents:
+        return []
+    if _RENDER_POOL is None:
+        _RENDER_POOL = ProcessPoolExecutor(max_workers=os.cpu_count() or 4)
+
+    loop = asyncio.get_running_loop()
+    filepaths = [f"{PDF_DIR}/{secrets.token_hex(16)}.pdf" for _ in html_contents]
+    futures = [
+        loop.run_in_executor(_RENDER_POOL, _render_pdf_to_file, html, path)
+        for html, path in zip(html_contents, filepaths)
+    ]
+    results = await asyncio.gather(*futures, return_exceptions=True)
+
+    paths = []
+    for result in results:
+        if isinstance(result, Exception):
+            logger.warning("Batch PDF render failed: %s", result)
+            paths.append("")
+        else:
+            paths.append(result)
+    return paths
+
+async def generate_pdf(html_content: str) -> str:
+    """
+    Generate a PDF from HTML content.
+    
+    Args:
+        html_content: HTML content to convert to PDF
         
+    Returns:
+        Path to the generated PDF file
+    """
+    debug = logger.isEnabledFor(logging.DEBUG)
+    if debug:
+        logger.debug("HTML content length: %s", len(html_content))
+        logger.debug("HTML content preview: %s...", html_content[:300])
+
+    # Identical editor HTML produces identical PDFs - serve the one already
+    # rendered if it still exists on disk. Keyed on the raw input so a hit
+    # skips preprocessing as well as the render.
+    cache_key = hashlib.blake2b(html_content.encode(), digest_size=16).hexdigest()
+    cached_path = _PDF_CACHE.get(cache_key)
+    if cached_path is not None and os.path.exists(cached_path):
+        _PDF_CACHE.move_to_end(cache_key)
+        logger.debug("Serving cached PDF %s for identical content", cached_path)
+        return cached_path
+
+    # One random id per request. token_hex returns a ready-made hex string,
+    # skipping the UUID object construction uuid4 does on top of the same
+    # CSPRNG read; the debug dump reuses the id so the two files correlate.
+    request_id = secrets.token_hex(16)
+    filepath = f"{PDF_DIR}/{request_id}.pdf"
+    
+    try:
+        # Clean, serialize and render in a worker thread: the tree walk's
+        # image downsampling does real CPU and disk work on first sight of
+        # an oversized image, and write_pdf is CPU-bound throughout, so the
+        # whole pipeline stays off the event loop. The capacity limiter lets
+        # concurrent requests render in parallel up to the core count
+        # without unbounded thread/memory growth; the render writes straight
+        # to disk from the worker thread, so the event loop never touches
+        # the PDF bytes at all.
+        img_tags, html_bytes = await anyio.to_thread.run_sync(
+            _prepare_pdf, html_content, filepath, limiter=_get_render_limiter()
+        )
+
+        if debug:
+            logger.debug("Found %s images in HTML:", len(img_tags))
+            for i, img in enumerate(img_tags[:5]):
+                logger.debug("Image %s: %s", i, img)
+            _debug_probe_images(img_tags, html_bytes.decode('utf-8'))
+            logger.debug("Base URL for images: %s", _BASE_URL)
+            # Dump the cleaned HTML for inspection as a background thread
+            # task so the write doesn't delay the response
+            debug_html_path = f"{PDF_DIR}/debug_{request_id}.html"
+            dump = asyncio.create_task(
+                asyncio.to_thread(_write_debug_html, debug_html_path, html_bytes)
+            )
+            _DEBUG_DUMP_TASKS.add(dump)
+            dump.add_done_callback(_DEBUG_DUMP_TASKS.discard)
+
+        logger.debug("Successfully generated PDF at %s", filepath)
+
+        _PDF_CACHE[cache_key] = filepath
+        if len(_PDF_CACHE) > _PDF_CACHE_SIZE:
+            _PDF_CACHE.popitem(last=False)
         return filepath
     
     except Exception as e:
-        print(f"ERROR generating PDF: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Error generating PDF: %s", e)
         # Return a placeholder path
         return ""
 
@@ -302,13 +547,9 @@ def render_template_to_html(template_name: str, context: dict) -> str:
     Returns:
         Rendered HTML content
     """
-    # Set up Jinja2 environment
-    env = Environment(loader=FileSystemLoader("templates"))
-    template = env.get_template(template_name)
-    
     # Add current datetime to context if not already present
     if 'now' not in context:
         context['now'] = datetime.now()
-    
-    # Render the template
-    return template.render(**context) 
\ No newline at end of file
+
+    # Render the template (compiled once, cached in the module environment)
+    return _JINJA_ENV.get_template(template_name).render(**context) 
\ No newline at end of file